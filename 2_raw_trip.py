@@ -11,15 +11,27 @@ It reads from random_od_pairs.csv and writes to trip2.csv with the following col
 - Optimized Route: Formatted transit route string
 """
 
-import requests
-from datetime import datetime, timedelta
+import asyncio
+import aiohttp
 import csv
+import json
 import logging
-from math import radians, sin, cos, sqrt, atan2
-from typing import Tuple, Optional
+import time
+from collections import OrderedDict
+from typing import List, Tuple, Optional
+
+import numpy as np
 
 import config
 
+# Use orjson for faster parsing of API responses if available
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    # orjson not installed, using the standard library parser
+    _json_loads = json.loads
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,72 +41,113 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+def haversine(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
     """
     Calculate the great circle distance between two points on Earth using the Haversine formula.
     
+    Vectorized with NumPy: pass coordinate arrays to compute all distances at once
+    (scalars also work).
+    
     Args:
-        lat1: Latitude of first point in degrees
-        lon1: Longitude of first point in degrees
-        lat2: Latitude of second point in degrees
-        lon2: Longitude of second point in degrees
+        lat1: Latitude of first point(s) in degrees
+        lon1: Longitude of first point(s) in degrees
+        lat2: Latitude of second point(s) in degrees
+        lon2: Longitude of second point(s) in degrees
         
     Returns:
-        Distance between the two points in kilometers
+        Distance(s) between the points in kilometers
     """
     # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
     
     # Haversine formula
     dlat = lat2 - lat1
     dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    # 2*arcsin(sqrt(a)) == 2*arctan2(sqrt(a), sqrt(1-a)) for a in [0, 1], with one sqrt fewer;
+    # clamp guards against a rounding just above 1 for near-antipodal points
+    c = 2 * np.arcsin(np.minimum(1.0, np.sqrt(a)))
     
     # Calculate the result using Earth radius from config
     distance = config.EARTH_RADIUS_KM * c
     return distance
 
 
-def get_local_departure_time(lat: float, lon: float, api_key: str) -> Optional[int]:
+async def _get_json(session: aiohttp.ClientSession, url: str, timeout: float) -> dict:
     """
-    Get the local departure time (noon) for a given location using Google Timezone API.
+    Send a GET request over the shared session and decode the JSON response
+    (with orjson when installed).
+    
+    Connection errors, timeouts, 429 and 5xx responses are retried up to
+    config.API_MAX_RETRIES times with exponential backoff.
     
     Args:
+        session: Shared aiohttp client session
+        url: Request URL
+        timeout: Total timeout per attempt in seconds
+        
+    Returns:
+        Decoded JSON response
+        
+    Raises:
+        aiohttp.ClientError: If the request still fails after all retries
+        asyncio.TimeoutError: If the last attempt times out
+        ValueError: If the response body is not valid JSON
+    """
+    for attempt in range(config.API_MAX_RETRIES + 1):
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                return _json_loads(await response.read())
+        except aiohttp.ClientResponseError as e:
+            if attempt == config.API_MAX_RETRIES or not (e.status == 429 or e.status >= 500):
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == config.API_MAX_RETRIES:
+                raise
+        await asyncio.sleep(config.API_RETRY_BACKOFF * 2 ** attempt)
+
+
+# In-flight or completed timezone offset lookups, keyed by coarse (lat, lon) tile,
+# in least-recently-used order (bounded by config.TIMEZONE_CACHE_SIZE)
+_tz_offset_cache: "OrderedDict[Tuple[float, float], asyncio.Future[Optional[int]]]" = OrderedDict()
+
+
+async def _fetch_tz_offset(
+    session: aiohttp.ClientSession,
+    lat: float,
+    lon: float,
+    api_key: str
+) -> Optional[int]:
+    """
+    Fetch the current UTC offset for a location from Google Timezone API.
+    
+    Args:
+        session: Shared aiohttp client session
         lat: Latitude of the location
         lon: Longitude of the location
         api_key: Google Maps API key
         
     Returns:
-        Unix timestamp for local noon, or None if API call fails
+        UTC offset in seconds (rawOffset + dstOffset), or None if API call fails
     """
     try:
         tz_url = (
             f"{config.GOOGLE_TIMEZONE_API_URL}"
             f"?location={lat},{lon}"
-            f"&timestamp={int(datetime.utcnow().timestamp())}"
+            f"&timestamp={int(time.time())}"
             f"&key={api_key}"
         )
         
-        response = requests.get(tz_url, timeout=10)
-        response.raise_for_status()
-        tz_data = response.json()
+        tz_data = await _get_json(session, tz_url, timeout=10)
         
         if tz_data["status"] != "OK":
             logger.warning(f"Time Zone API Error: {tz_data.get('status', 'UNKNOWN')}")
             return None
         
-        offset = tz_data["rawOffset"] + tz_data["dstOffset"]
-        local_now = datetime.utcnow() + timedelta(seconds=offset)
-        local_noon = local_now.replace(
-            hour=config.DEPARTURE_HOUR,
-            minute=0,
-            second=0,
-            microsecond=0
-        )
-        return int(local_noon.timestamp())
+        return tz_data["rawOffset"] + tz_data["dstOffset"]
         
-    except requests.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Failed to fetch timezone data: {e}")
         return None
     except (KeyError, ValueError) as e:
@@ -102,7 +155,81 @@ def get_local_departure_time(lat: float, lon: float, api_key: str) -> Optional[i
         return None
 
 
-def fetch_transit_route(
+async def _tz_offset(
+    session: aiohttp.ClientSession,
+    lat_q: float,
+    lon_q: float,
+    api_key: str
+) -> Optional[int]:
+    """
+    Get the UTC offset for a coarse (lat, lon) tile, querying the API once per tile.
+    
+    Concurrent callers for the same tile share a single in-flight request.
+    Failed lookups are not cached, so a later row may retry the tile. At most
+    config.TIMEZONE_CACHE_SIZE tiles are kept, evicting the least recently used.
+    
+    Args:
+        session: Shared aiohttp client session
+        lat_q: Rounded latitude of the tile
+        lon_q: Rounded longitude of the tile
+        api_key: Google Maps API key
+        
+    Returns:
+        UTC offset in seconds, or None if API call fails
+    """
+    key = (lat_q, lon_q)
+    lookup = _tz_offset_cache.get(key)
+    if lookup is None:
+        lookup = asyncio.ensure_future(_fetch_tz_offset(session, lat_q, lon_q, api_key))
+        _tz_offset_cache[key] = lookup
+        # Evict the least recently used tiles (awaiting callers keep their future)
+        while len(_tz_offset_cache) > config.TIMEZONE_CACHE_SIZE:
+            _tz_offset_cache.popitem(last=False)
+    else:
+        _tz_offset_cache.move_to_end(key)
+    
+    offset = await lookup
+    if offset is None and _tz_offset_cache.get(key) is lookup:
+        del _tz_offset_cache[key]
+    return offset
+
+
+async def get_local_departure_time(
+    session: aiohttp.ClientSession,
+    lat: float,
+    lon: float,
+    api_key: str
+) -> Optional[int]:
+    """
+    Get the local departure time (noon) for a given location using Google Timezone API.
+    
+    Timezone offsets are looked up once per coarse tile of
+    config.TIMEZONE_TILE_DECIMALS decimal degrees, since they are constant locally.
+    
+    Args:
+        session: Shared aiohttp client session
+        lat: Latitude of the location
+        lon: Longitude of the location
+        api_key: Google Maps API key
+        
+    Returns:
+        Unix timestamp for local noon, or None if API call fails
+    """
+    lat_q = round(lat, config.TIMEZONE_TILE_DECIMALS)
+    lon_q = round(lon, config.TIMEZONE_TILE_DECIMALS)
+    
+    offset = await _tz_offset(session, lat_q, lon_q, api_key)
+    if offset is None:
+        return None
+    
+    # Start of the current local day, shifted back to UTC seconds
+    now = int(time.time())
+    local_day_start = ((now + offset) // 86400) * 86400
+    return local_day_start + config.DEPARTURE_HOUR * 3600 - offset
+
+
+async def fetch_transit_route(
+    session: aiohttp.ClientSession,
     origin: str,
     destination: str,
     departure_time: int,
@@ -112,6 +239,7 @@ def fetch_transit_route(
     Fetch transit route from Google Directions API.
     
     Args:
+        session: Shared aiohttp client session
         origin: Origin coordinates as "lat,lon"
         destination: Destination coordinates as "lat,lon"
         departure_time: Unix timestamp for departure time
@@ -132,9 +260,7 @@ def fetch_transit_route(
             f"&key={api_key}"
         )
         
-        response = requests.get(directions_url, timeout=30)
-        response.raise_for_status()
-        directions_data = response.json()
+        directions_data = await _get_json(session, directions_url, timeout=30)
         
         if directions_data["status"] != "OK":
             logger.warning(f"Directions API Error: {directions_data.get('status', 'UNKNOWN')}")
@@ -142,7 +268,7 @@ def fetch_transit_route(
         
         return directions_data
         
-    except requests.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Failed to fetch directions: {e}")
         return None
     except (KeyError, ValueError) as e:
@@ -186,8 +312,10 @@ def format_route(steps: list) -> str:
     return " -> ".join(formatted_route)
 
 
-def process_od_pair(
-    row: list,
+async def process_od_pair(
+    session: aiohttp.ClientSession,
+    coords: Tuple[float, float, float, float],
+    distance_km: float,
     row_number: int,
     api_key: str
 ) -> Optional[Tuple[str, str, float, str]]:
@@ -195,7 +323,9 @@ def process_od_pair(
     Process a single origin-destination pair and return the results.
     
     Args:
-        row: CSV row containing [origin_lat, origin_lon, destination_lat, destination_lon]
+        session: Shared aiohttp client session
+        coords: Parsed (origin_lat, origin_lon, destination_lat, destination_lon)
+        distance_km: Precomputed Haversine distance in kilometers
         row_number: Row number for logging purposes
         api_key: Google Maps API key
         
@@ -203,11 +333,7 @@ def process_od_pair(
         Tuple of (origin, destination, distance_km, formatted_route) or None if processing fails
     """
     try:
-        # Parse coordinates
-        origin_lat = float(row[0])
-        origin_lon = float(row[1])
-        dest_lat = float(row[2])
-        dest_lon = float(row[3])
+        origin_lat, origin_lon, dest_lat, dest_lon = coords
         
         origin = f"{origin_lat},{origin_lon}"
         destination = f"{dest_lat},{dest_lon}"
@@ -215,13 +341,15 @@ def process_od_pair(
         logger.info(f"[Row {row_number}] Processing: Origin={origin}, Destination={destination}")
         
         # Get local departure time
-        departure_time = get_local_departure_time(origin_lat, origin_lon, api_key)
+        departure_time = await get_local_departure_time(session, origin_lat, origin_lon, api_key)
         if departure_time is None:
             logger.warning(f"[Row {row_number}] Failed to get departure time, skipping")
             return None
         
         # Fetch transit route
-        directions_data = fetch_transit_route(origin, destination, departure_time, api_key)
+        directions_data = await fetch_transit_route(
+            session, origin, destination, departure_time, api_key
+        )
         if directions_data is None:
             logger.warning(f"[Row {row_number}] Failed to fetch route, skipping")
             return None
@@ -237,20 +365,85 @@ def process_od_pair(
         # Format route
         formatted_route = format_route(steps)
         
-        # Calculate Haversine distance
-        distance_km = haversine(origin_lat, origin_lon, dest_lat, dest_lon)
-        
         logger.info(f"[Row {row_number}] Successfully processed")
         return (origin, destination, distance_km, formatted_route)
         
-    except (ValueError, IndexError) as e:
-        logger.error(f"[Row {row_number}] Error parsing coordinates: {e}")
-        return None
     except Exception as e:
         logger.error(f"[Row {row_number}] Unexpected error: {e}", exc_info=True)
         return None
 
 
+async def process_all(
+    rows: List[Tuple[int, Tuple[float, float, float, float], float]],
+    fout,
+    api_key: str,
+    concurrency: int
+) -> Tuple[int, int]:
+    """
+    Process OD pairs concurrently and write results as they complete.
+    
+    At most `concurrency` rows are in flight at once. Results are written by this
+    coroutine only, so the CSV writer is never shared between tasks. Output rows
+    are in completion order rather than input order, and are written in batches
+    of config.WRITE_BATCH_SIZE rows (flushed after each batch and on exit).
+    
+    Args:
+        rows: List of (row_number, coords, distance_km) tuples to process
+        fout: Output file opened for writing
+        api_key: Google Maps API key
+        concurrency: Maximum number of rows processed at the same time
+        
+    Returns:
+        Tuple of (processed_count, skipped_count)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    writer = csv.writer(fout)
+    batch = []
+    processed_count = 0
+    skipped_count = 0
+    
+    # Reuse keep-alive connections across rows; cache DNS for the whole run
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    
+    async with aiohttp.ClientSession(connector=connector) as session:
+        
+        async def bounded_process(coords, distance_km: float, row_number: int):
+            async with semaphore:
+                return await process_od_pair(session, coords, distance_km, row_number, api_key)
+        
+        tasks = [
+            asyncio.create_task(bounded_process(coords, distance_km, row_number))
+            for row_number, coords, distance_km in rows
+        ]
+        
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                
+                if result is not None:
+                    origin, destination, distance_km, formatted_route = result
+                    batch.append([
+                        origin,
+                        destination,
+                        f"{distance_km:.2f}",
+                        formatted_route
+                    ])
+                    processed_count += 1
+                    
+                    if len(batch) >= config.WRITE_BATCH_SIZE:
+                        writer.writerows(batch)
+                        fout.flush()
+                        batch.clear()
+                else:
+                    skipped_count += 1
+        finally:
+            # Write out any remaining results, also when interrupted
+            writer.writerows(batch)
+            fout.flush()
+    
+    return processed_count, skipped_count
+
+
 def main():
     """
     Main function to process origin-destination pairs and generate trip data.
@@ -277,13 +470,14 @@ def main():
     
     logger.info(f"Reading from: {input_csv}")
     logger.info(f"Writing to: {output_csv}")
+    logger.info(f"Concurrent requests: {config.API_CONCURRENCY}")
     
     processed_count = 0
     skipped_count = 0
     
     try:
         with open(input_csv, 'r', newline='', encoding='utf-8') as fin, \
-             open(output_csv, 'a', newline='', encoding='utf-8') as fout:
+             open(output_csv, 'a', newline='', encoding='utf-8', buffering=1 << 20) as fout:
             
             reader = csv.reader(fin)
             writer = csv.writer(fout)
@@ -296,26 +490,35 @@ def main():
                 writer.writerow(config.TRIP2_COLUMNS)
                 logger.info("Created new output file with header")
             
-            # Process each row
+            # Collect and parse coordinates of rows to process
+            row_numbers = []
+            coords = []
             for row_number, row in enumerate(reader, start=1):
                 if len(row) < 4:
                     logger.warning(f"[Row {row_number}] Insufficient columns, skipping")
                     skipped_count += 1
                     continue
-                
-                result = process_od_pair(row, row_number, api_key)
-                
-                if result is not None:
-                    origin, destination, distance_km, formatted_route = result
-                    writer.writerow([
-                        origin,
-                        destination,
-                        f"{distance_km:.2f}",
-                        formatted_route
-                    ])
-                    processed_count += 1
-                else:
+                try:
+                    coords.append(tuple(float(value) for value in row[:4]))
+                except ValueError as e:
+                    logger.error(f"[Row {row_number}] Error parsing coordinates: {e}")
                     skipped_count += 1
+                    continue
+                row_numbers.append(row_number)
+            
+            # Calculate all Haversine distances in one vectorized pass
+            coord_array = np.array(coords, dtype=np.float64).reshape(-1, 4)
+            distances = haversine(
+                coord_array[:, 0], coord_array[:, 1], coord_array[:, 2], coord_array[:, 3]
+            )
+            rows = list(zip(row_numbers, coords, distances.tolist()))
+            
+            # Process rows concurrently
+            processed, skipped = asyncio.run(
+                process_all(rows, fout, api_key, config.API_CONCURRENCY)
+            )
+            processed_count += processed
+            skipped_count += skipped
                     
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
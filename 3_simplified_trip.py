@@ -10,12 +10,17 @@ Input: trip2.csv (from stage 2)
 Output: trip3.csv (simplified routes with 'Total Trip' column)
 """
 
-import re
-import pandas as pd
+import csv
+import functools
+import os
 import logging
+import re
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
+from typing import List, Tuple
 
-from config import TRIP2_CSV, TRIP3_CSV, ensure_directory
+from config import TRIP2_CSV, TRIP3_CSV, PROCESS_BATCH_SIZE, ensure_directory
 
 # Configure logging
 logging.basicConfig(
@@ -24,13 +29,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Route segment pattern: mode(time), where time starts with a digit
+_SEGMENT_RE = re.compile(r'(?P<mode>\w+)\((?P<time>\d+\.?\d*[^\)]+)\)')
+
 
+@functools.lru_cache(maxsize=4096)
 def convert_time_to_minutes(time_str: str) -> int:
     """
     Convert Korean time string to total minutes.
     
     Parses time strings in Korean format (e.g., '1시간 8분', '29분', '1시간')
-    and converts them to total minutes as an integer.
+    and converts them to total minutes as an integer. Results are memoized,
+    since routes draw on a small set of distinct duration strings.
     
     Args:
         time_str: Time string in Korean format (e.g., '1시간 8분', '29분')
@@ -49,25 +59,49 @@ def convert_time_to_minutes(time_str: str) -> int:
     hours = 0
     minutes = 0
     
+    # Take the number directly preceding each unit (e.g. '1시간 8분' -> 1, 8)
     if '시간' in time_str:
-        hours_match = re.search(r'(\d+)\s*시간', time_str)
-        if hours_match:
-            hours = int(hours_match.group(1))
+        hours_str, _, time_str = time_str.partition('시간')
+        hours = _trailing_number(hours_str, '0123456789')
     
     if '분' in time_str:
-        minutes_match = re.search(r'(\d+\.?\d*)\s*분', time_str)
-        if minutes_match:
-            minutes = float(minutes_match.group(1))
+        minutes_str, _, _ = time_str.partition('분')
+        minutes = _trailing_number(minutes_str, '0123456789.')
     
     return int(hours * 60 + minutes)
 
 
+def _trailing_number(text: str, number_chars: str) -> float:
+    """
+    Parse the number at the end of a string, ignoring trailing whitespace.
+    
+    Args:
+        text: String that may end with a number (e.g., '1일3', '8 ')
+        number_chars: Characters that make up the number (digits, optionally '.')
+        
+    Returns:
+        The trailing number, or 0 if the string does not end with a valid number
+        
+    Examples:
+        >>> _trailing_number('1일3', '0123456789')
+        3.0
+        >>> _trailing_number('약 ', '0123456789')
+        0
+    """
+    text = text.rstrip()
+    try:
+        return float(text[len(text.rstrip(number_chars)):])
+    except ValueError:
+        return 0
+
+
+@functools.lru_cache(maxsize=4096)
 def convert_minutes_to_time(minutes: int) -> str:
     """
     Convert total minutes to Korean time string format.
     
     Converts an integer number of minutes back to Korean time format,
-    showing hours and/or minutes as appropriate.
+    showing hours and/or minutes as appropriate. Results are memoized.
     
     Args:
         minutes: Total minutes as integer
@@ -94,98 +128,132 @@ def convert_minutes_to_time(minutes: int) -> str:
         return f"{mins}분"
 
 
-def simplify_trip(trip: str) -> str:
+def parse_trip(trip: str) -> List[Tuple[str, int]]:
+    """
+    Parse a trip route string into a list of (mode, minutes) segments.
+    
+    All 'mode(time)' segments are tokenized in a single pass with one
+    named-group pattern. Segments whose time does not start with a digit
+    are skipped.
+    
+    Args:
+        trip: Trip route string in format 'mode1(time1) -> mode2(time2) -> ...'
+              Example: 'walking(5분) -> bus(15분)'
+        
+    Returns:
+        List of (mode, minutes) tuples
+        Example: [('walking', 5), ('bus', 15)]
+    """
+    return [
+        (match['mode'], convert_time_to_minutes(match['time']))
+        for match in _SEGMENT_RE.finditer(trip)
+    ]
+
+
+def format_trip(segments: List[Tuple[str, int]]) -> str:
     """
-    Simplify a transit trip route by merging consecutive modes and handling walking segments.
+    Format a list of (mode, minutes) segments as a trip route string.
     
-    This function processes a trip route string and applies the following simplifications:
+    Args:
+        segments: List of (mode, minutes) tuples
+        
+    Returns:
+        Trip route string in format 'mode1(time1) -> mode2(time2) -> ...'
+        
+    Examples:
+        >>> format_trip([('walking', 5), ('bus', 68)])
+        'walking(5분) -> bus(1시간 8분)'
+    """
+    return " -> ".join(
+        f"{mode}({convert_minutes_to_time(minutes)})" for mode, minutes in segments
+    )
+
+
+def simplify_trip(segments: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+    """
+    Simplify a transit trip by merging consecutive modes and handling walking segments.
+    
+    This function processes parsed trip segments and applies the following simplifications:
     1. Merges consecutive segments of the same transit mode (e.g., bus, subway)
     2. Absorbs intermediate walking segments into adjacent transit modes
     3. Preserves only the first and last walking segments of the trip
     
     Args:
-        trip: Trip route string in format 'mode1(time1) -> mode2(time2) -> ...'
-              Example: 'walking(5분) -> bus(15분) -> walking(3분) -> subway(20분) -> walking(2분)'
+        segments: List of (mode, minutes) tuples, as returned by parse_trip()
+              Example: [('walking', 5), ('bus', 15), ('walking', 3), ('subway', 20), ('walking', 2)]
         
     Returns:
-        Simplified trip route string with merged modes and reduced walking segments
-        Example: 'walking(5분) -> bus(18분) -> subway(20분) -> walking(2분)'
-        
-    Note:
-        The function uses regex to parse segments in the format 'mode(time)'
-        and processes them sequentially to apply the simplification rules.
+        Simplified list of (mode, minutes) tuples with merged modes and reduced walking segments
+        Example: [('walking', 5), ('bus', 18), ('subway', 20), ('walking', 2)]
     """
-    # Extract all segments matching pattern: mode(time)
-    segments = re.findall(r'(\w+\(\d+\.?\d*[^\)]+\))', trip)
     processed_segments = []
     total_time = 0
     current_mode = None
     
-    for i, segment in enumerate(segments):
-        match = re.match(r'(\w+)\((.+)\)', segment)
-        if not match:
-            logger.warning(f"Could not parse segment: {segment}")
-            continue
-            
-        mode, time = match.groups()
+    for i, (mode, minutes) in enumerate(segments):
 
         # Handle walking: absorb intermediate, keep first and last
         if mode == "walking":
-            if i == 0:  # First walking segment - keep it
-                # Save accumulated time for previous mode if exists
-                if current_mode:
-                    processed_segments.append(
-                        f"{current_mode}({convert_minutes_to_time(total_time)})"
-                    )
-                    current_mode = None
-                    total_time = 0
-                # Add the walking segment
-                processed_segments.append(segment)
-            elif i == len(segments) - 1:  # Last walking segment - keep it
+            if i == 0 or i == len(segments) - 1:  # First or last walking segment - keep it
                 # Save accumulated time for previous mode if exists
                 if current_mode:
-                    processed_segments.append(
-                        f"{current_mode}({convert_minutes_to_time(total_time)})"
-                    )
+                    processed_segments.append((current_mode, total_time))
                     current_mode = None
                     total_time = 0
                 # Add the walking segment
-                processed_segments.append(segment)
+                processed_segments.append((mode, minutes))
             else:
                 # Intermediate walking - absorb into previous mode if it exists
                 if current_mode:
                     # Add walking time to the current mode's total time
-                    total_time += convert_time_to_minutes(time)
+                    total_time += minutes
                 # If no previous mode, the walking segment is lost (shouldn't happen in practice)
             continue
 
         # Accumulate time for the same mode
         if mode == current_mode:
-            total_time += convert_time_to_minutes(time)
+            total_time += minutes
         else:
             # Save previous mode if exists
             if current_mode:
-                processed_segments.append(
-                    f"{current_mode}({convert_minutes_to_time(total_time)})"
-                )
+                processed_segments.append((current_mode, total_time))
             # Start new mode
             current_mode = mode
-            total_time = convert_time_to_minutes(time)
+            total_time = minutes
 
     # Append the last accumulated mode (if not already saved by last walking segment)
     if current_mode:
-        processed_segments.append(
-            f"{current_mode}({convert_minutes_to_time(total_time)})"
-        )
+        processed_segments.append((current_mode, total_time))
 
-    return " -> ".join(processed_segments)
+    return processed_segments
+
+
+@functools.lru_cache(maxsize=200_000)
+def simplify_route(trip: str) -> str:
+    """
+    Simplify a trip route string (parse, simplify, and format in one call).
+    
+    Results are memoized on the route string, since identical routes repeat
+    often in OD datasets (each worker process keeps its own cache).
+    
+    Args:
+        trip: Trip route string in format 'mode1(time1) -> mode2(time2) -> ...'
+              Example: 'walking(5분) -> bus(15분) -> walking(3분) -> subway(20분) -> walking(2분)'
+        
+    Returns:
+        Simplified trip route string
+        Example: 'walking(5분) -> bus(18분) -> subway(20분) -> walking(2분)'
+    """
+    return format_trip(simplify_trip(parse_trip(trip)))
 
 
 def main():
     """
     Main function to process trip data and generate simplified routes.
     
-    Reads trip2.csv, applies simplification to routes, and saves results to trip3.csv.
+    Streams trip2.csv in batches of PROCESS_BATCH_SIZE rows, simplifies each batch
+    of routes across all CPU cores, and writes the results to trip3.csv
+    (overwriting any existing file).
     """
     logger.info(f"Reading input file: {TRIP2_CSV}")
     
@@ -196,37 +264,49 @@ def main():
             "Please ensure stage 2 (2_raw_trip.py) has been run successfully."
         )
     
-    # Read the input data
-    try:
-        data = pd.read_csv(TRIP2_CSV)
-        logger.info(f"Loaded {len(data)} trip records")
-    except Exception as e:
-        logger.error(f"Error reading input file: {e}")
-        raise
-    
-    # Check required columns
-    required_columns = ['Optimized Route']
-    missing_columns = [col for col in required_columns if col not in data.columns]
-    if missing_columns:
-        raise ValueError(
-            f"Missing required columns in input file: {missing_columns}\n"
-            f"Available columns: {list(data.columns)}"
-        )
-    
-    # Apply the simplification function
-    logger.info("Simplifying trip routes...")
-    data['Total Trip'] = data['Optimized Route'].apply(simplify_trip)
-    
     # Ensure output directory exists
     ensure_directory(TRIP3_CSV)
     
-    # Save the modified dataset
+    logger.info("Simplifying trip routes...")
     logger.info(f"Saving output to: {TRIP3_CSV}")
+    processed_count = 0
+    chunksize = max(100, PROCESS_BATCH_SIZE // ((os.cpu_count() or 1) * 4))
+    
     try:
-        data.to_csv(TRIP3_CSV, index=False)
-        logger.info(f"Successfully saved {len(data)} simplified trip records")
+        with open(TRIP2_CSV, 'r', newline='', encoding='utf-8') as fin, \
+             open(TRIP3_CSV, 'w', newline='', encoding='utf-8') as fout, \
+             Pool() as pool:
+            
+            reader = csv.reader(fin)
+            
+            # Check required columns
+            fieldnames = next(reader, [])
+            required_columns = ['Optimized Route']
+            missing_columns = [col for col in required_columns if col not in fieldnames]
+            if missing_columns:
+                raise ValueError(
+                    f"Missing required columns in input file: {missing_columns}\n"
+                    f"Available columns: {fieldnames}"
+                )
+            
+            writer = csv.writer(fout, lineterminator='\n')
+            writer.writerow(fieldnames + ['Total Trip'])
+            route_index = fieldnames.index('Optimized Route')
+            
+            # Apply the simplification function across all CPU cores, one batch at a time
+            while batch := list(islice(reader, PROCESS_BATCH_SIZE)):
+                # Skip blank and short rows (csv.reader yields [] for blank lines)
+                rows = [row for row in batch if len(row) > route_index]
+                routes = [row[route_index] for row in rows]
+                totals = pool.map(simplify_route, routes, chunksize=chunksize)
+                writer.writerows(row + [total_trip] for row, total_trip in zip(rows, totals))
+                
+                processed_count += len(rows)
+                logger.info(f"Processed {processed_count} trip records")
+        
+        logger.info(f"Successfully saved {processed_count} simplified trip records")
     except Exception as e:
-        logger.error(f"Error saving output file: {e}")
+        logger.error(f"Error processing trip records: {e}")
         raise
 
 
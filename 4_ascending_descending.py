@@ -1,20 +1,36 @@
 """
 Script 4: Ascending/Descending Route Split
 
-This script processes simplified trip data from stage 3 and splits each route
-into ascending and descending segments based on the midpoint of total trip duration.
-The route is divided at the 50% time point, with segments split if necessary.
+This script processes raw trip data from stage 2, simplifies each route with the
+stage 3 rules, and splits it into ascending and descending segments based on the
+midpoint of total trip duration. The route is divided at the 50% time point, with
+segments split if necessary.
 
-Input: trip3.csv (from stage 3, must contain 'Total Trip' column)
+Each route is parsed once and handed between the simplification and split steps
+as a list of (mode, minutes) tuples, so the intermediate trip3.csv is not needed.
+Pass --dump-intermediate to write it anyway.
+
+Input: trip2.csv (from stage 2, must contain 'Optimized Route' column)
 Output: trip4.csv (with 'Ascending' and 'Descending' columns)
+        trip3.csv (optional, with 'Total Trip' column)
 """
 
-import re
-import pandas as pd
+import argparse
+import csv
+import functools
+import importlib
+import os
 import logging
+from bisect import bisect_left
+from contextlib import ExitStack
+from itertools import accumulate, islice
+from multiprocessing import Pool
 from pathlib import Path
+from typing import List, Optional, Tuple
 
-from config import TRIP3_CSV, TRIP4_CSV, ensure_directory
+from config import (
+    TRIP2_CSV, TRIP3_CSV, TRIP4_CSV, TRIP4_COLUMNS, PROCESS_BATCH_SIZE, ensure_directory
+)
 
 # Configure logging
 logging.basicConfig(
@@ -23,35 +39,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-
-def parse_duration_to_minutes(duration_str: str) -> float:
-    """
-    Convert Korean time string format to total minutes as float.
-    
-    Parses time strings in Korean format (e.g., "1시간 30분", "45분", "2시간")
-    and converts them to total minutes as a float value.
-    
-    Args:
-        duration_str: Time string in Korean format
-        
-    Returns:
-        Total minutes as float
-        
-    Examples:
-        >>> parse_duration_to_minutes("1시간 30분")
-        90.0
-        >>> parse_duration_to_minutes("45분")
-        45.0
-        >>> parse_duration_to_minutes("2시간")
-        120.0
-    """
-    hours_pattern = re.search(r'(\d+)\s*시간', duration_str)
-    mins_pattern = re.search(r'(\d+)\s*분', duration_str)
-
-    hours = float(hours_pattern.group(1)) if hours_pattern else 0.0
-    mins = float(mins_pattern.group(1)) if mins_pattern else 0.0
-
-    return hours * 60.0 + mins
+# Stage 3 module (file name starts with a digit, so it cannot be imported directly)
+simplified_trip = importlib.import_module("3_simplified_trip")
 
 
 def format_minutes_to_string(minutes: float) -> str:
@@ -62,7 +51,7 @@ def format_minutes_to_string(minutes: float) -> str:
     showing hours and/or minutes as appropriate. Supports decimal minutes.
     
     Args:
-        minutes: Total minutes as float (can include decimals)
+        minutes: Total minutes (int for whole steps, float for split portions)
         
     Returns:
         Time string in Korean format (e.g., "1시간 30분", "45분", "2.5분")
@@ -89,177 +78,203 @@ def format_minutes_to_string(minutes: float) -> str:
         return f"{m}분"  # Example: "2.5분"
 
 
-def split_route_in_half(route_str: str) -> tuple[str, str]:
+def format_route_steps(steps: List[Tuple[str, float]]) -> str:
+    """
+    Format a list of (mode, minutes) steps as a route string.
+    
+    Args:
+        steps: List of (mode, minutes) tuples
+        
+    Returns:
+        Route string in format "mode1(time1) -> mode2(time2) -> ..."
+        
+    Examples:
+        >>> format_route_steps([("walking", 7), ("subway", 2.5)])
+        "walking(7분) -> subway(2.5분)"
+    """
+    return " -> ".join(
+        f"{mode}({format_minutes_to_string(minutes)})" for mode, minutes in steps
+    )
+
+
+def split_route_in_half(
+    steps: List[Tuple[str, float]]
+) -> Tuple[List[Tuple[str, float]], List[Tuple[str, float]]]:
     """
-    Split a route string into ascending and descending segments at the midpoint.
+    Split route steps into ascending and descending segments at the midpoint.
     
-    Divides a transit route string at the 50% time point. If a segment spans
+    Divides a transit route at the 50% time point. If a step spans
     the midpoint, it is split proportionally between ascending and descending.
     
     Args:
-        route_str: Route string in format "mode1(time1) -> mode2(time2) -> ..."
-                  Example: "walking(7분) -> subway(6분) -> walking(6분)"
+        steps: List of (mode, minutes) tuples
+              Example: [("walking", 7), ("subway", 6), ("walking", 6)]
         
     Returns:
-        Tuple of (ascending_str, descending_str) where:
-        - ascending_str: Route segments up to the midpoint
-        - descending_str: Route segments after the midpoint (or "N/A" if empty)
+        Tuple of (ascending, descending) step lists where:
+        - ascending: Steps up to the midpoint
+        - descending: Steps after the midpoint (empty if none)
         
     Note:
-        The function calculates total trip duration, finds the midpoint,
-        and distributes segments accordingly. Segments crossing the midpoint
-        are split proportionally.
+        The function builds the cumulative durations once and binary-searches
+        them for the first step that reaches the midpoint. Steps before it go
+        to ascending and steps after it to descending. A step that crosses the
+        midpoint is split proportionally.
     """
-    # Split route by "->" delimiter to get individual steps
-    raw_steps = [s.strip() for s in route_str.split("->") if s.strip()]
-
-    # Store each step with its duration in minutes (as float)
-    steps_with_minutes = []
-    total_minutes = 0.0
-
-    for step in raw_steps:
-        # Parse duration from parentheses. Example: "walking(7분)" -> "7분"
-        match = re.search(r"\(([^)]+)\)", step)
-        if match:
-            duration_str = match.group(1)  # Example: "7분"
-            dur_min = parse_duration_to_minutes(duration_str)
-        else:
-            dur_min = 0.0  # If no time info, treat as 0 minutes
-
-        steps_with_minutes.append((step, dur_min))
-        total_minutes += dur_min
-
-    # Calculate midpoint (can be decimal)
-    half_time = total_minutes / 2.0
-
-    ascending, descending = [], []
-    accumulated = 0.0
-    half_reached = False
+    if not steps:
+        return [], []
 
-    for i, (step_text, dur_min) in enumerate(steps_with_minutes):
-        if half_reached:
-            # Already past midpoint, add all remaining steps to descending
-            descending.append((step_text, dur_min))
-            continue
+    # Cumulative duration at the end of each step; midpoint can be decimal
+    cumulative = list(accumulate(dur_min for _, dur_min in steps))
+    half_time = cumulative[-1] / 2.0
 
-        if accumulated + dur_min < half_time:
-            # Not yet at midpoint, add entire step to ascending
-            ascending.append((step_text, dur_min))
-            accumulated += dur_min
-        elif abs(accumulated + dur_min - half_time) < 1e-9:
-            # Exactly at midpoint
-            ascending.append((step_text, dur_min))
-            accumulated += dur_min
-            half_reached = True
-        else:
-            # Step crosses midpoint → need to split this step
-            # Add remaining portion to ascending, rest to descending
-            remain_to_half = half_time - accumulated  # Example: 2.5
-            if remain_to_half < 0:
-                # Already exceeded half_time, add all to descending
-                descending.append((step_text, dur_min))
-            else:
-                # Split the step proportionally
-                ascending_part = remain_to_half
-                descending_part = dur_min - remain_to_half
+    # First step whose cumulative duration reaches the midpoint
+    idx = bisect_left(cumulative, half_time)
 
-                # Extract base mode name from step_text
-                # Example: "walking(7분)" -> "walking"
-                base_name = step_text.split("(")[0].strip()
+    if abs(cumulative[idx] - half_time) < 1e-9:
+        # Step ends exactly at the midpoint
+        return steps[:idx + 1], steps[idx + 1:]
 
-                # Create new step strings for ascending and descending portions
-                ascend_text = f"{base_name}({format_minutes_to_string(ascending_part)})"
-                descend_text = f"{base_name}({format_minutes_to_string(descending_part)})"
+    # Step crosses midpoint → split it proportionally
+    mode, dur_min = steps[idx]
+    ascending_part = half_time - (cumulative[idx - 1] if idx > 0 else 0.0)  # Example: 2.5
+    descending_part = dur_min - ascending_part
 
-                ascending.append((ascend_text, ascending_part))
-                if descending_part > 0:
-                    descending.append((descend_text, descending_part))
+    return (
+        steps[:idx] + [(mode, ascending_part)],
+        [(mode, descending_part)] + steps[idx + 1:],
+    )
 
-            # Mark that we've reached the midpoint
-            half_reached = True
 
-    # Reconstruct ascending route string
-    ascending_str = " -> ".join(
-        f"{stp[0]}" for stp in ascending
+@functools.lru_cache(maxsize=200_000)
+def process_route(route: str) -> Tuple[str, str, str]:
+    """
+    Simplify a raw stage 2 route and split it at the midpoint in a single pass.
+    
+    The route string is parsed once; simplification (stage 3) and the split
+    both operate on the parsed (mode, minutes) list, and strings are only
+    built for the output columns. Results are memoized on the route string,
+    since identical routes repeat often in OD datasets.
+    
+    Args:
+        route: Raw route string from the 'Optimized Route' column of trip2.csv
+        
+    Returns:
+        Tuple of (total_trip, ascending, descending) route strings, where
+        descending is "N/A" if empty
+    """
+    segments = simplified_trip.simplify_trip(simplified_trip.parse_trip(route))
+    ascending, descending = split_route_in_half(segments)
+    return (
+        simplified_trip.format_trip(segments),
+        format_route_steps(ascending),
+        format_route_steps(descending) if descending else "N/A",
     )
-    # Reconstruct descending route string
-    descending_str = " -> ".join(
-        f"{stp[0]}" for stp in descending
-    ) if descending else "N/A"
 
-    return ascending_str, descending_str
 
-
-def main():
+def main(argv: Optional[List[str]] = None):
     """
     Main function to process trip data and split routes into ascending/descending segments.
     
-    Reads trip3.csv, splits each route at the midpoint, and saves results to trip4.csv.
+    Streams trip2.csv in batches of PROCESS_BATCH_SIZE rows, simplifies each route
+    and splits it at the midpoint across all CPU cores, and writes the results to
+    trip4.csv (overwriting any existing file). With --dump-intermediate, the
+    simplified routes are also written to trip3.csv.
+    
+    Args:
+        argv: Command-line arguments (defaults to sys.argv[1:])
     """
-    logger.info(f"Reading input file: {TRIP3_CSV}")
+    parser = argparse.ArgumentParser(
+        description="Simplify routes and split them into ascending/descending segments."
+    )
+    parser.add_argument(
+        "--dump-intermediate",
+        action="store_true",
+        help=f"also write the simplified routes (stage 3 output) to {TRIP3_CSV}",
+    )
+    args = parser.parse_args(argv)
+    
+    logger.info(f"Reading input file: {TRIP2_CSV}")
     
     # Check if input file exists
-    if not TRIP3_CSV.exists():
+    if not TRIP2_CSV.exists():
         raise FileNotFoundError(
-            f"Input file not found: {TRIP3_CSV}\n"
-            "Please ensure stage 3 (3_simplified_trip.py) has been run successfully."
+            f"Input file not found: {TRIP2_CSV}\n"
+            "Please ensure stage 2 (2_raw_trip.py) has been run successfully."
         )
     
-    # Read the input data
-    try:
-        data = pd.read_csv(TRIP3_CSV)
-        logger.info(f"Loaded {len(data)} trip records")
-    except Exception as e:
-        logger.error(f"Error reading input file: {e}")
-        raise
-    
-    # Check required columns
-    required_columns = ['Total Trip']
-    missing_columns = [col for col in required_columns if col not in data.columns]
-    if missing_columns:
-        raise ValueError(
-            f"Missing required columns in input file: {missing_columns}\n"
-            f"Available columns: {list(data.columns)}"
-        )
+    # Ensure output directories exist
+    ensure_directory(TRIP4_CSV)
+    if args.dump_intermediate:
+        ensure_directory(TRIP3_CSV)
     
-    # Initialize result columns
-    logger.info("Splitting routes into ascending and descending segments...")
-    data["Ascending"] = ""
-    data["Descending"] = ""
+    logger.info("Simplifying routes and splitting into ascending and descending segments...")
+    logger.info(f"Saving output to: {TRIP4_CSV}")
+    if args.dump_intermediate:
+        logger.info(f"Saving intermediate output to: {TRIP3_CSV}")
+    processed_count = 0
+    sample = []
+    chunksize = max(100, PROCESS_BATCH_SIZE // ((os.cpu_count() or 1) * 4))
     
-    # Process each row
-    for i, row in data.iterrows():
-        route_str = row["Total Trip"]
+    try:
+        with ExitStack() as stack:
+            fin = stack.enter_context(open(TRIP2_CSV, 'r', newline='', encoding='utf-8'))
+            fout = stack.enter_context(open(TRIP4_CSV, 'w', newline='', encoding='utf-8'))
+            pool = stack.enter_context(Pool())
+            
+            reader = csv.reader(fin)
+            
+            # Check required columns
+            fieldnames = next(reader, [])
+            required_columns = ['Optimized Route']
+            missing_columns = [col for col in required_columns if col not in fieldnames]
+            if missing_columns:
+                raise ValueError(
+                    f"Missing required columns in input file: {missing_columns}\n"
+                    f"Available columns: {fieldnames}"
+                )
+            
+            writer = csv.writer(fout, lineterminator='\n')
+            writer.writerow(TRIP4_COLUMNS)
+            route_index = fieldnames.index('Optimized Route')
+            
+            # Optionally save the simplified routes (stage 3 output)
+            trip3_writer = None
+            if args.dump_intermediate:
+                trip3_out = stack.enter_context(open(TRIP3_CSV, 'w', newline='', encoding='utf-8'))
+                trip3_writer = csv.writer(trip3_out, lineterminator='\n')
+                trip3_writer.writerow(fieldnames + ['Total Trip'])
+            
+            # Simplify and split each route across all CPU cores, one batch at a time
+            while batch := list(islice(reader, PROCESS_BATCH_SIZE)):
+                # Skip blank and short rows (csv.reader yields [] for blank lines)
+                rows = [row for row in batch if len(row) > route_index]
+                routes = [row[route_index] for row in rows]
+                results = pool.map(process_route, routes, chunksize=chunksize)
+                writer.writerows(
+                    (ascending_str, descending_str) for _, ascending_str, descending_str in results
+                )
+                
+                if trip3_writer is not None:
+                    trip3_writer.writerows(
+                        row + [total_trip] for row, (total_trip, _, _) in zip(rows, results)
+                    )
+                
+                if len(sample) < 5:
+                    sample.extend(results[:5 - len(sample)])
+                processed_count += len(rows)
+                logger.info(f"Processed {processed_count} records")
         
-        ascending_str, descending_str = split_route_in_half(route_str)
+        logger.info(f"Completed processing {processed_count} records")
         
-        # Record results in DataFrame
-        data.at[i, "Ascending"] = ascending_str
-        data.at[i, "Descending"] = descending_str
+        # Display sample results
+        logger.info("Sample results:")
+        for total_trip, ascending_str, descending_str in sample:
+            logger.info(f"  {total_trip}  =>  {ascending_str}  |  {descending_str}")
         
-        if (i + 1) % 100 == 0:
-            logger.info(f"Processed {i + 1}/{len(data)} records")
-    
-    logger.info(f"Completed processing {len(data)} records")
-    
-    # Display sample results
-    logger.info("Sample results:")
-    logger.info(f"\n{data[['Total Trip', 'Ascending', 'Descending']].head()}")
-    
-    # Extract only Ascending and Descending columns for output
-    required_columns = ["Ascending", "Descending"]
-    filtered_data = data[required_columns]
-    
-    # Ensure output directory exists
-    ensure_directory(TRIP4_CSV)
-    
-    # Save the results
-    logger.info(f"Saving output to: {TRIP4_CSV}")
-    try:
-        filtered_data.to_csv(TRIP4_CSV, index=False)
-        logger.info(f"Successfully saved {len(filtered_data)} records to {TRIP4_CSV}")
+        logger.info(f"Successfully saved {processed_count} records to {TRIP4_CSV}")
     except Exception as e:
-        logger.error(f"Error saving output file: {e}")
+        logger.error(f"Error processing trip records: {e}")
         raise
 
 
@@ -10,13 +10,27 @@ Input: trip4.csv (from stage 4, must contain 'Ascending' and 'Descending' column
 Output: final.csv (with 'Transition', 'Count', and 'Type' columns)
 """
 
+import numpy as np
 import pandas as pd
-from collections import Counter
-import re
+import os
 import logging
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Iterable, List, Tuple
 
-from config import TRIP4_CSV, FINAL_CSV, ensure_directory
+from config import TRIP4_CSV, TRIP4_COLUMNS, FINAL_CSV, PROCESS_BATCH_SIZE, ensure_directory
+
+# Read route columns as Arrow-backed strings (contiguous UTF-8 buffers) and write
+# the results with the Arrow CSV writer if available
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    _ROUTE_DTYPE = pd.ArrowDtype(pa.string())
+except ImportError:
+    # pyarrow not installed, using object strings and DataFrame.to_csv
+    pa_csv = None
+    _ROUTE_DTYPE = str
 
 # Configure logging
 logging.basicConfig(
@@ -26,53 +40,147 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def extract_transitions(column_data: pd.Series) -> Counter:
+def extract_transitions(route_data: pd.DataFrame) -> pd.DataFrame:
     """
-    Extract and count mode transitions from a route column.
+    Extract and count mode transitions from the ascending and descending route columns.
     
     Parses route strings in the format "mode1(time1) -> mode2(time2) -> ..."
     and counts all transitions between consecutive transportation modes.
+    Both route columns are stacked into one Series and processed in a single
+    pass: routes are split on the " -> " delimiter and each segment is cut at
+    its "(" with plain string splits. Segments whose time does not start with a
+    digit are skipped, as in stage 3. The modes are encoded
+    as small integer codes, and consecutive pairs within each route are counted
+    into a dense T x K x K array (T = route types, K = distinct modes) instead
+    of a hashmap.
     
     Args:
-        column_data: Pandas Series containing route strings with mode transitions
+        route_data: DataFrame containing 'Ascending' and 'Descending' columns with
+                    route strings
         
     Returns:
-        Counter object mapping transition strings (e.g., "walking -> subway") to counts
+        DataFrame with columns: ['Type', 'From', 'To', 'Count'], one row per unique
+        transition of each route type (e.g., Type="Ascending", From="walking",
+        To="subway"); Type, From and To are categorical
         
     Examples:
-        >>> routes = pd.Series(["walking(5분) -> subway(10분) -> walking(3분)"])
+        >>> routes = pd.DataFrame({
+        ...     "Ascending": ["walking(5분) -> subway(10분)", "walking(2분) -> subway(8분)"],
+        ...     "Descending": ["subway(5분) -> walking(3분)", None],
+        ... })
         >>> counts = extract_transitions(routes)
-        >>> counts["walking -> subway"]
-        1
-        >>> counts["subway -> walking"]
-        1
+        >>> counts.astype(str).values.tolist()
+        [['Ascending', 'walking', 'subway', '2'], ['Descending', 'subway', 'walking', '1']]
+    """
+    # Stack the route columns into one Series; route i of column t gets the
+    # label t * len(route_data) + i
+    record_count = len(route_data)
+    stacked = pd.concat([route_data[col] for col in TRIP4_COLUMNS], ignore_index=True)
+    
+    # Split all routes into segments at once, skipping NaN values, with one row
+    # per segment keeping the route's index label
+    segments = stacked.dropna().str.split(' -> ', regex=False).explode()
+    
+    # Skip segments without a "(time)" starting with a digit, as stage 3 does
+    has_time = segments.str.contains(r'^[^(]*\(\d', regex=True).to_numpy(dtype=bool)
+    segments = segments[has_time]
+    
+    # Keep the mode in front of each segment's "(time)"
+    # Example: "walking(5분)" -> "walking", "subway(10분)" -> "subway"
+    parts = segments.str.split('(', n=1, regex=False)
+    if isinstance(parts.dtype, pd.ArrowDtype):
+        # The .list accessor returns a fresh index; restore the route labels
+        modes = parts.list[0].set_axis(segments.index)
+    else:
+        modes = parts.str[0]
+    modes = modes.astype('category')
+    categories = modes.cat.categories
+    codes = modes.cat.codes.to_numpy()
+    
+    # Pair each mode with the next mode of the same route; segments of one route
+    # are adjacent after explode and share the route's index label
+    row_ids = modes.index.to_numpy()
+    same_row = row_ids[1:] == row_ids[:-1]
+    type_codes = row_ids[1:][same_row] // max(record_count, 1)
+    from_codes = codes[:-1][same_row]
+    to_codes = codes[1:][same_row]
+    
+    # Count transitions between consecutive modes in one pass over flat
+    # (type, from, to) cell indices of the T x K x K array
+    type_count = len(TRIP4_COLUMNS)
+    mode_count = len(categories)
+    matrix = np.bincount(
+        (type_codes.astype(np.int64) * mode_count + from_codes) * mode_count + to_codes,
+        minlength=type_count * mode_count * mode_count,
+    ).reshape(type_count, mode_count, mode_count)
+    
+    # One row per observed transition (unsorted; the final result is sorted once)
+    type_codes, from_codes, to_codes = np.nonzero(matrix)
+    return pd.DataFrame({
+        'Type': pd.Categorical.from_codes(type_codes, TRIP4_COLUMNS),
+        'From': pd.Categorical.from_codes(from_codes, categories),
+        'To': pd.Categorical.from_codes(to_codes, categories),
+        'Count': matrix[type_codes, from_codes, to_codes],
+    })
+
+
+def merge_transition_counts(counts_list: List[pd.DataFrame]) -> pd.DataFrame:
     """
-    transition_counts = Counter()
-    
-    # Process each route string, skipping NaN values
-    for row in column_data.dropna():
-        # Extract transportation modes using regex
-        # Pattern matches: word characters followed by parentheses with any content
-        # Example: "walking(5분)" -> "walking", "subway(10분)" -> "subway"
-        modes = re.findall(r'(\w+)\(\d+.*?\)', row)
+    Merge per-chunk transition counts into a single count per transition.
+    
+    Args:
+        counts_list: List of DataFrames as returned by extract_transitions()
         
-        # Count transitions between consecutive modes
-        for i in range(len(modes) - 1):
-            transition = f"{modes[i]} -> {modes[i+1]}"
-            transition_counts[transition] += 1
+    Returns:
+        DataFrame with columns: ['Type', 'From', 'To', 'Count'], one row per unique
+        transition of each route type
+    """
+    if not counts_list:
+        return extract_transitions(pd.DataFrame(columns=TRIP4_COLUMNS, dtype=_ROUTE_DTYPE))
+    
+    merged = pd.concat(counts_list, ignore_index=True).groupby(
+        ['Type', 'From', 'To'], observed=True, sort=False
+    )['Count'].sum()
+    return merged.reset_index(name='Count')
 
-    return transition_counts
+
+def count_chunk_transitions(chunk: pd.DataFrame) -> Tuple[int, pd.DataFrame]:
+    """
+    Count ascending and descending transitions in one chunk of trip records.
+    
+    Args:
+        chunk: DataFrame containing 'Ascending' and 'Descending' columns with route strings
+        
+    Returns:
+        Tuple of (record_count, counts), where counts is a DataFrame as returned
+        by extract_transitions()
+        
+    Raises:
+        ValueError: If required columns are missing from the chunk
+    """
+    # Check required columns
+    missing_columns = [col for col in TRIP4_COLUMNS if col not in chunk.columns]
+    if missing_columns:
+        raise ValueError(
+            f"Missing required columns in input file: {missing_columns}\n"
+            f"Available columns: {list(chunk.columns)}"
+        )
+    
+    return len(chunk), extract_transitions(chunk)
 
 
-def process_transitions(df: pd.DataFrame) -> pd.DataFrame:
+def process_transitions(chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
     """
     Process ascending and descending transitions and combine into a single DataFrame.
     
-    Extracts transitions from both 'Ascending' and 'Descending' columns, counts them,
-    and combines the results with a 'Type' column to distinguish the route segment.
+    Extracts transitions from both 'Ascending' and 'Descending' columns of each chunk
+    across all CPU cores (one chunk per worker at a time), merges the per-chunk
+    counts, and builds the result with a 'Type' column to distinguish the route
+    segment.
     
     Args:
-        df: DataFrame containing 'Ascending' and 'Descending' columns with route strings
+        chunks: Iterable of DataFrames containing 'Ascending' and 'Descending'
+                columns with route strings (e.g., a chunked pd.read_csv reader)
         
     Returns:
         DataFrame with columns: ['Transition', 'Count', 'Type']
@@ -83,44 +191,44 @@ def process_transitions(df: pd.DataFrame) -> pd.DataFrame:
     Raises:
         ValueError: If required columns are missing from the input DataFrame
     """
-    # Check required columns
-    required_columns = ['Ascending', 'Descending']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        raise ValueError(
-            f"Missing required columns in input file: {missing_columns}\n"
-            f"Available columns: {list(df.columns)}"
-        )
+    counts_list = []
+    record_count = 0
     
-    logger.info("Extracting transitions from ascending routes...")
-    ascending_transitions = extract_transitions(df["Ascending"])
-    logger.info(f"Found {len(ascending_transitions)} unique ascending transitions")
+    logger.info("Extracting transitions from ascending and descending routes...")
+    worker_count = os.cpu_count() or 1
+    chunks = iter(chunks)  # islice must consume the chunks, even for a list
+    with Pool(worker_count) as pool:
+        # Hand out one chunk per worker at a time, so at most that many chunks
+        # are held in memory at once
+        while batch := list(islice(chunks, worker_count)):
+            for chunk_count, counts in pool.map(count_chunk_transitions, batch):
+                counts_list.append(counts)
+                record_count += chunk_count
+            logger.info(f"Processed {record_count} trip records")
     
-    logger.info("Extracting transitions from descending routes...")
-    descending_transitions = extract_transitions(df["Descending"])
-    logger.info(f"Found {len(descending_transitions)} unique descending transitions")
+    transitions = merge_transition_counts(counts_list)
     
-    # Convert Counter objects to DataFrames for better visualization
-    ascending_df = pd.DataFrame(
-        ascending_transitions.items(), 
-        columns=["Transition", "Count"]
-    ).sort_values(by="Count", ascending=False)
+    # Build transition strings once per unique transition, as one vectorized
+    # concat over the route string dtype (an Arrow kernel when pyarrow is installed);
+    # counts fit in int32
+    combined_df = pd.DataFrame({
+        "Transition": (
+            transitions["From"].astype(_ROUTE_DTYPE) + " -> "
+            + transitions["To"].astype(_ROUTE_DTYPE)
+        ),
+        "Count": transitions["Count"].astype(np.int32),
+        "Type": transitions["Type"],
+    })
     
-    descending_df = pd.DataFrame(
-        descending_transitions.items(), 
-        columns=["Transition", "Count"]
-    ).sort_values(by="Count", ascending=False)
-    
-    # Add Type column to distinguish ascending vs descending
-    ascending_df["Type"] = "Ascending"
-    descending_df["Type"] = "Descending"
-    
-    # Combine both DataFrames into a single result
-    combined_df = pd.concat([ascending_df, descending_df], ignore_index=True)
+    # Sort once by Type and then by Count in descending order
+    combined_df.sort_values(
+        by=["Type", "Count"], ascending=[True, False], inplace=True, ignore_index=True
+    )
     
+    type_counts = combined_df["Type"].value_counts()
     logger.info(f"Total transitions found: {len(combined_df)}")
-    logger.info(f"  - Ascending: {len(ascending_df)}")
-    logger.info(f"  - Descending: {len(descending_df)}")
+    logger.info(f"  - Ascending: {type_counts['Ascending']}")
+    logger.info(f"  - Descending: {type_counts['Descending']}")
     
     return combined_df
 
@@ -129,8 +237,8 @@ def main():
     """
     Main function to process trip data and count mode transitions.
     
-    Reads trip4.csv, extracts transitions from ascending and descending routes,
-    and saves the combined results to final.csv.
+    Streams trip4.csv in chunks, extracts transitions from ascending and descending
+    routes, and saves the combined results to final.csv.
     """
     logger.info(f"Reading input file: {TRIP4_CSV}")
     
@@ -141,22 +249,27 @@ def main():
             "Please ensure stage 4 (4_ascending_descending.py) has been run successfully."
         )
     
-    # Read the input data
+    # Read the input data in chunks of PROCESS_BATCH_SIZE rows, parsing only the
+    # route columns (falls back to all columns so missing ones are reported)
     try:
-        df = pd.read_csv(TRIP4_CSV)
-        logger.info(f"Loaded {len(df)} trip records")
+        header = pd.read_csv(TRIP4_CSV, nrows=0).columns
+        usecols = TRIP4_COLUMNS if set(TRIP4_COLUMNS) <= set(header) else None
+        chunks = pd.read_csv(
+            TRIP4_CSV, usecols=usecols, dtype=_ROUTE_DTYPE, chunksize=PROCESS_BATCH_SIZE
+        )
     except Exception as e:
         logger.error(f"Error reading input file: {e}")
         raise
     
     # Process transitions
-    combined_df = process_transitions(df)
+    with chunks:
+        combined_df = process_transitions(chunks)
     
     # Display top transitions
     logger.info("\nTop 10 transitions (all types):")
     top_transitions = combined_df.nlargest(10, 'Count')
-    for _, row in top_transitions.iterrows():
-        logger.info(f"  {row['Transition']}: {row['Count']} ({row['Type']})")
+    for transition, count, route_type in top_transitions.itertuples(index=False):
+        logger.info(f"  {transition}: {count} ({route_type})")
     
     # Ensure output directory exists
     ensure_directory(FINAL_CSV)
@@ -164,7 +277,25 @@ def main():
     # Save the results
     logger.info(f"\nSaving output to: {FINAL_CSV}")
     try:
-        combined_df.to_csv(FINAL_CSV, index=False)
+        saved = False
+        if pa_csv is not None:
+            # Write unquoted fields so the output matches DataFrame.to_csv; the
+            # header (always quoted by Arrow) is written as-is. Arrow rejects
+            # fields that would need quoting, in which case to_csv is used instead.
+            table = pa.Table.from_pandas(combined_df, preserve_index=False)
+            try:
+                with open(FINAL_CSV, 'wb') as fout:
+                    fout.write((",".join(table.column_names) + "\n").encode('utf-8'))
+                    pa_csv.write_csv(
+                        table, fout,
+                        pa_csv.WriteOptions(include_header=False, quoting_style='none'),
+                    )
+                saved = True
+            except pa.ArrowInvalid as e:
+                logger.warning(f"Falling back to DataFrame.to_csv: {e}")
+        
+        if not saved:
+            combined_df.to_csv(FINAL_CSV, index=False)
         logger.info(f"Successfully saved {len(combined_df)} transition records to {FINAL_CSV}")
     except Exception as e:
         logger.error(f"Error saving output file: {e}")
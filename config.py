@@ -5,10 +5,12 @@ This module centralizes all file paths, constants, and configuration settings
 to improve maintainability and portability across different environments.
 """
 
+import functools
 import os
 from pathlib import Path
 
 # Try to load environment variables from .env file if dotenv is available
+# (loaded at import time, since the settings below are read from the environment)
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -109,9 +111,19 @@ WGS84_EPSG = int(os.getenv("WGS84_EPSG", "4326"))
 # Earth radius in kilometers (for Haversine distance calculation)
 EARTH_RADIUS_KM = float(os.getenv("EARTH_RADIUS_KM", "6371.0"))
 
+# Number of trip rows read and processed at a time (stages 3 to 5)
+PROCESS_BATCH_SIZE = int(os.getenv("PROCESS_BATCH_SIZE", "50000"))
+
 # Departure time hour (24-hour format, for transit route queries)
 DEPARTURE_HOUR = int(os.getenv("DEPARTURE_HOUR", "12"))
 
+# Decimal places of lat/lon used to group locations for timezone lookups
+# (1 decimal degree ~ 11 km tiles; one Timezone API call per tile)
+TIMEZONE_TILE_DECIMALS = int(os.getenv("TIMEZONE_TILE_DECIMALS", "1"))
+
+# Maximum number of tiles whose timezone offsets are cached in memory (stage 2)
+TIMEZONE_CACHE_SIZE = int(os.getenv("TIMEZONE_CACHE_SIZE", "8192"))
+
 # ============================================================================
 # Google Maps API Configuration
 # ============================================================================
@@ -125,6 +137,18 @@ TRANSIT_MODE = "transit"
 LANGUAGE = "ko"
 REGION = "KR"
 
+# Maximum number of OD pairs processed concurrently (in-flight API requests)
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", "32"))
+
+# Retries for failed API requests (connection errors, timeouts, 429/5xx)
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+
+# Base delay in seconds between retries (doubled after each attempt)
+API_RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF", "0.2"))
+
+# Number of stage 2 result rows buffered before each write to trip2.csv
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "128"))
+
 # ============================================================================
 # CSV Column Names
 # ============================================================================
@@ -143,17 +167,31 @@ FINAL_COLUMNS = ["Transition", "Count", "Type"]
 # ============================================================================
 
 
+@functools.lru_cache(maxsize=None)
+def _make_directory(directory: Path) -> None:
+    """
+    Create a directory (and its parents) once per process.
+    
+    Args:
+        directory: Directory path (Path object)
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+
+
 def ensure_directory(path: Path) -> Path:
     """
     Ensure that the directory for the given path exists.
     
+    Directories are created on first use only; repeated calls for paths in the
+    same directory do not issue another mkdir.
+    
     Args:
         path: File path (Path object)
         
     Returns:
         The path object (for chaining)
     """
-    path.parent.mkdir(parents=True, exist_ok=True)
+    _make_directory(path.parent)
     return path
 
 
@@ -178,6 +216,14 @@ def get_api_key() -> str:
 # Validation
 # ============================================================================
 
-# Validate that critical directories exist or can be created
-for directory in [PRE_DIR, RESULT_DIR, RESULT_POPULATION_DIR, RESULT_AREA_DIR]:
-    directory.mkdir(parents=True, exist_ok=True)
+
+def validate_dirs() -> None:
+    """
+    Ensure that the data directories exist, creating them if needed.
+    
+    Directories are not created at import time; call this to set up the
+    directory layout up front (output files are otherwise created on demand
+    through ensure_directory()).
+    """
+    for directory in [PRE_DIR, RESULT_DIR, RESULT_POPULATION_DIR, RESULT_AREA_DIR]:
+        _make_directory(directory)